@@ -1,16 +1,38 @@
 import pdb
 import os
+import bisect
+import heapq
 import datetime
+import dbm
+import functools
 import getpass
+import hashlib
+import hmac
+import itertools
+import json
+import math
 import pickle
+import re
 import argparse
-from typing import Any, Dict
+from collections.abc import MutableMapping
+from enum import IntEnum
+from typing import Any, Dict, Optional, Union
 
 from prettytable import PrettyTable
 
 ############### Global Resources ###############
 
 
+class Card(IntEnum):
+    ''' Supported card types '''
+    AMEX = 0
+    VISA = 1
+    DISCOVER = 2
+
+    def __str__(self):
+        return self.name.lower()
+
+
 card_rate = {
     'amex': 0.8,
     'visa': 1.0,
@@ -19,6 +41,35 @@ card_rate = {
 
 convenience_fee_rate = 0.2
 
+_VALID_CARDS = frozenset(card_rate)
+
+# Fee rates as fractions of the amount, precomputed from the percentages
+_CARD_TX_RATE = tuple(card_rate[str(card)] / 100.0 for card in Card)
+_CONV_RATE = convenience_fee_rate / 100.0
+
+# Valid menu selections on the login and logged in screens
+_LOGIN_MENU_RE = re.compile(r'^[1-3]$')
+_MENU_RE = re.compile(r'^[1-7]$')
+
+# Byte translation table flipping 0/1 status flags
+_NEGATE_FLAGS = bytes.maketrans(b'\x00\x01', b'\x01\x00')
+
+
+@functools.lru_cache(maxsize=4096)
+def _billing_cycle(year: int, month: int) -> str:
+    ''' Returns the billing cycle of a month as 'start, end' dates '''
+    start_date = datetime.date(year, month, 1)
+    if month == 12:
+        end_date = start_date.replace(year=year + 1, month=1) - datetime.timedelta(days=1)
+    else:
+        end_date = start_date.replace(month=month + 1) - datetime.timedelta(days=1)
+    return '{}, {}'.format(start_date, end_date)
+
+
+def _hash_password(password: str, salt: bytes) -> bytes:
+    ''' Returns the salted HMAC-SHA256 digest of a password '''
+    return hmac.new(salt, password.encode('utf-8'), hashlib.sha256).digest()
+
 
 ############### Classes ###############
 
@@ -26,22 +77,32 @@ convenience_fee_rate = 0.2
 class Purchase:
     ''' Class to model purchases '''
 
-    def __init__(self, date: datetime.date, card: str, amount: float,
-                 status: bool = False):
+    __slots__ = ('date', 'date_ord', 'card', 'status', 'amount',
+                 '_transaction_fee', '_convenience_fee', 'final_amount',
+                 'billing_cycle')
+
+    def __init__(self, date: datetime.date, card: Union[str, Card],
+                 amount: float, status: bool = False):
         ''' Initializer '''
         # Purchase date
         self.date = date
+        self.date_ord = date.toordinal()  # Cheaper to compare than dates
         # Card type
-        assert card in card_rate, 'Unsupported card type: {}. The only \
-            supported types are: {}.'.format(card, list(card_rate.keys()))
+        if isinstance(card, str):
+            if card not in _VALID_CARDS:
+                raise ValueError('Unsupported card type: {}. The only supported '
+                                 'types are: {}.'.format(card, list(card_rate.keys())))
+            card = Card[card.upper()]
+        else:
+            card = Card(card)  # Raises ValueError for unknown card values
         self.card = card
         # Status
-        self.status = status  # False indicates 'due' and True indicates 'paid'
+        self.status = bool(status)  # False indicates 'due' and True indicates 'paid'
         # Amounts and fees
         self.amount = amount
         if not self.status:
-            self._transaction_fee = self.amount * card_rate[self.card] / 100
-            self._convenience_fee = self.amount * convenience_fee_rate / 100
+            self._transaction_fee = self.amount * _CARD_TX_RATE[self.card]
+            self._convenience_fee = self.amount * _CONV_RATE
         else:
             self._transaction_fee = 0
             self._convenience_fee = 0
@@ -49,27 +110,56 @@ class Purchase:
                             self._transaction_fee + \
                             self._convenience_fee
         # Billing cycle
-        start_date = self.date.replace(day=1)
-        if self.date.month == 12:
-            end_date = self.date.replace(year=self.date.year + 1, month=1, day=1) - datetime.timedelta(days=1)
-        else:
-            end_date = self.date.replace(month=self.date.month + 1, day=1) - datetime.timedelta(days=1)
-        self.billing_cycle = '{}, {}'.format(start_date, end_date)
+        self.billing_cycle = _billing_cycle(self.date.year, self.date.month)
 
     def __repr__(self):
         return '{}: Amount {} on {} for card {} [Cycle: {}]'.format('Purchase' if not self.status else 'Payment',
                                                                     self.final_amount, self.date, self.card,
                                                                     self.billing_cycle)
 
+    def to_dict(self) -> Dict[str, Any]:
+        ''' Serializes the purchase to native types '''
+        return {'date': self.date.isoformat(), 'card': str(self.card),
+                'amount': self.amount, 'status': self.status,
+                'transaction_fee': self._transaction_fee,
+                'convenience_fee': self._convenience_fee}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]):
+        ''' Rebuilds a purchase serialized by to_dict. Fees are computed from
+            the current rates only if the record does not carry them.
+        '''
+        p = cls(datetime.date.fromisoformat(d['date']), d['card'],
+                d['amount'], d.get('status', False))
+        if 'transaction_fee' in d:
+            # Keep the fees charged when the purchase was made
+            p._transaction_fee = d['transaction_fee']
+            p._convenience_fee = d['convenience_fee']
+            p.final_amount = p.amount + p._transaction_fee + p._convenience_fee
+        return p
+
 
 class PurchaseLog:
     ''' Data structure to store log of purchases for a user '''
 
+    __slots__ = ('log', '_date_ords', '_paid', '_bit_due', '_min_heap',
+                 '_max_heap', '_heap_seq', 'total_due', 'total_paid')
+
     def __init__(self):
         ''' Initializer '''
         self.log = []
-        self.min_purchase = None
-        self.max_purchase = None
+        # Columns kept in lockstep with self.log: purchase date ordinals for
+        # bisection and statuses (1 for paid) for filtering
+        self._date_ords = []
+        self._paid = bytearray()
+        # Fenwick tree over due amounts by log position, for range totals.
+        # None when stale, until the next range query rebuilds it.
+        self._bit_due = []
+        # Heaps of due purchases keyed on final amount (max heap via negation)
+        self._min_heap = []
+        self._max_heap = []
+        # Insertion counter breaking ties, so the first purchase added wins
+        self._heap_seq = itertools.count()
         self.total_due = 0
         self.total_paid = 0
 
@@ -77,85 +167,358 @@ class PurchaseLog:
         ''' Implements binary search to insert a new purchase based on its
             date.
         '''
-        # Insert purchase in log
-        if len(self.log) == 0:
-            self.log.insert(0, purchase)
-            if not purchase.status:
-                self.min_purchase = purchase
-                self.max_purchase = purchase
+        # Insert purchase in log, after any purchases on the same date
+        if not self._date_ords or purchase.date_ord >= self._date_ords[-1]:
+            ## Purchases mostly arrive in date order: append without shifting
+            self.log.append(purchase)
+            self._date_ords.append(purchase.date_ord)
+            self._paid.append(purchase.status)
+            if self._bit_due is not None:
+                self._bit_append(0 if purchase.status else purchase.final_amount)
         else:
-            ## Binary search for insertion
-            _start = 0
-            _end = len(self.log) - 1
-            while _end - _start > 1:
-                _mid = (_start + _end) // 2
-                if self.log[_mid].date > purchase.date:
-                    _end = _mid - 1
-                else:
-                    _start = _mid + 1
-            if purchase.date < self.log[_start].date:
-                self.log.insert(_start, purchase)
-            elif purchase.date >= self.log[_end].date:
-                self.log.insert(_end + 1, purchase)
-            else:
-                self.log.insert(_end, purchase)
-            ## Update min and max purchase
-            if not purchase.status:
-                if self.min_purchase is None:
-                    self.min_purchase = purchase
-                elif self.min_purchase.final_amount > purchase.final_amount:
-                    self.min_purchase = purchase
-                if self.max_purchase is None:
-                    self.max_purchase = purchase
-                elif self.max_purchase.final_amount < purchase.final_amount:
-                    self.max_purchase = purchase
+            i = bisect.bisect_right(self._date_ords, purchase.date_ord)
+            self.log.insert(i, purchase)
+            self._date_ords.insert(i, purchase.date_ord)
+            self._paid.insert(i, purchase.status)
+            ## Every node past i shifts, so leave the rebuild to the next
+            ## range query rather than redoing it for each back-dated insert
+            self._bit_due = None
+        # Update min and max purchase
+        if not purchase.status:
+            seq = next(self._heap_seq)
+            heapq.heappush(self._min_heap, (purchase.final_amount, seq, purchase))
+            heapq.heappush(self._max_heap, (-purchase.final_amount, seq, purchase))
         # Update totals
         if not purchase.status:
             self.total_due += purchase.final_amount
         else:
             self.total_paid += purchase.final_amount
 
+    def _bit_append(self, amount):
+        ''' Extends the Fenwick tree with the amount of a purchase appended
+            to the log.
+        '''
+        # Node j covers positions (j - lowbit(j), j]
+        j = len(self._bit_due) + 1
+        self._bit_due.append(amount + self._bit_prefix(j - 1)
+                             - self._bit_prefix(j - (j & -j)))
+
+    def _bit_rebuild(self):
+        ''' Rebuilds the Fenwick tree from the log in linear time '''
+        tree = [0 if p.status else p.final_amount for p in self.log]
+        for j in range(1, len(tree) + 1):
+            parent = j + (j & -j)
+            if parent <= len(tree):
+                tree[parent - 1] += tree[j - 1]
+        self._bit_due = tree
+
+    def _bit_prefix(self, i):
+        ''' Returns the total due over the first i purchases of the log '''
+        total = 0
+        while i > 0:
+            total += self._bit_due[i - 1]
+            i -= i & -i
+        return total
+
+    def _range_bounds(self, start, end):
+        ''' Returns the slice of the log dated between start and end,
+            inclusive.
+        '''
+        lo = bisect.bisect_left(self._date_ords, start.toordinal())
+        hi = bisect.bisect_right(self._date_ords, end.toordinal())
+        return lo, max(lo, hi)
+
+    @staticmethod
+    def _heap_top(heap):
+        ''' Drops purchases that are no longer due from the top of the heap
+            and returns the purchase left on top, if any.
+        '''
+        while heap and heap[0][2].status:
+            heapq.heappop(heap)
+        return heap[0][2] if heap else None
+
+    @property
+    def min_purchase(self):
+        return self._heap_top(self._min_heap)
+
+    @property
+    def max_purchase(self):
+        return self._heap_top(self._max_heap)
+
     def query_totals(self):
         return self.total_due, self.total_paid
 
     def query_purchases(self, status=False):
-        return [p for p in self.log if p.status == status]
+        ''' Returns an iterator over purchases with the given status '''
+        selectors = self._paid if status else self._paid.translate(_NEGATE_FLAGS)
+        return itertools.compress(self.log, selectors)
+
+    def query_range(self, start, end, status=False):
+        ''' Returns an iterator over purchases with the given status dated
+            between start and end, inclusive.
+        '''
+        # The log is sorted by date, so the range is a contiguous slice
+        lo, hi = self._range_bounds(start, end)
+        selectors = self._paid[lo:hi]
+        if not status:
+            selectors = selectors.translate(_NEGATE_FLAGS)
+        return itertools.compress(self.log[lo:hi], selectors)
+
+    def range_due(self, start, end):
+        ''' Returns the total due for purchases dated between start and end,
+            inclusive.
+        '''
+        if self._bit_due is None:
+            self._bit_rebuild()
+        lo, hi = self._range_bounds(start, end)
+        return self._bit_prefix(hi) - self._bit_prefix(lo)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ''' Serializes the log to native types '''
+        return {'purchases': [p.to_dict() for p in self.log]}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]):
+        ''' Rebuilds a log serialized by to_dict, recomputing its totals '''
+        purchase_log = cls()
+        for p in d['purchases']:
+            purchase_log.add_purchase(Purchase.from_dict(p))
+        return purchase_log
 
 
 class UserAccount:
     ''' Class for a user account '''
 
+    __slots__ = ('name', 'fullname', 'phone_num', 'password_salt',
+                 'password_hash', 'country', 'address', 'purchase_log',
+                 'journal_seq')
+
     def __init__(self, name: str, fullname: str, phone_num: str, \
-                 password: str, country: str, address: str):
+                 password_salt: bytes, password_hash: bytes, country: str, \
+                 address: str):
         ''' Initializer '''
         self.name = name
         self.fullname = fullname
         self.phone_num = phone_num
-        self.password = password
+        # Only a salted digest of the password is kept
+        self.password_salt = password_salt
+        self.password_hash = password_hash
         self.country = country
         self.address = address
         self.purchase_log = PurchaseLog()
+        # Sequence number of the last journaled transaction in purchase_log
+        self.journal_seq = 0
+
+    @classmethod
+    def from_password(cls, name: str, fullname: str, phone_num: str, \
+                      password: str, country: str, address: str):
+        ''' Creates an account, hashing the password with a fresh salt '''
+        salt = os.urandom(16)
+        return cls(name=name, fullname=fullname, phone_num=phone_num,
+                   password_salt=salt, password_hash=_hash_password(password, salt),
+                   country=country, address=address)
+
+    def check_password(self, password: str) -> bool:
+        ''' Compares a password against the stored digest in constant time '''
+        return hmac.compare_digest(_hash_password(password, self.password_salt),
+                                   self.password_hash)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ''' Serializes the account to native types '''
+        return {'name': self.name, 'fullname': self.fullname,
+                'phone_num': self.phone_num,
+                'password_salt': self.password_salt.hex(),
+                'password_hash': self.password_hash.hex(),
+                'country': self.country, 'address': self.address,
+                'purchase_log': self.purchase_log.to_dict(),
+                'journal_seq': self.journal_seq}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]):
+        ''' Rebuilds an account serialized by to_dict '''
+        uaccount = cls(name=d['name'], fullname=d['fullname'],
+                       phone_num=d['phone_num'],
+                       password_salt=bytes.fromhex(d['password_salt']),
+                       password_hash=bytes.fromhex(d['password_hash']),
+                       country=d['country'], address=d['address'])
+        uaccount.purchase_log = PurchaseLog.from_dict(d['purchase_log'])
+        uaccount.journal_seq = d.get('journal_seq', 0)
+        return uaccount
+
+
+class UserDatabase(MutableMapping):
+    ''' Mapping of usernames to user accounts stored one record per user,
+        so only the accounts actually used are read from disk.
+    '''
+
+    def __init__(self, filename: str):
+        ''' Initializer '''
+        self._db = dbm.open(filename, 'c')
+        # Accounts loaded so far
+        self._cache = {}
+
+    def __getitem__(self, uname):
+        if uname not in self._cache:
+            self._cache[uname] = UserAccount.from_dict(json.loads(self._db[uname]))
+        return self._cache[uname]
+
+    def __setitem__(self, uname, uaccount):
+        self._cache[uname] = uaccount
+        self._db[uname] = json.dumps(uaccount.to_dict())
+        self.sync()
+
+    def __delitem__(self, uname):
+        self._cache.pop(uname, None)
+        del self._db[uname]
+        self.sync()
+
+    def __contains__(self, uname):
+        return uname in self._cache or uname in self._db
+
+    def __iter__(self):
+        return (uname.decode('utf-8') for uname in self._db.keys())
+
+    def __len__(self):
+        return len(self._db)
+
+    def sync(self):
+        ''' Flushes written records to disk, if the dbm backend buffers them '''
+        if hasattr(self._db, 'sync'):
+            self._db.sync()
+
+    def close(self):
+        self._db.close()
+
+
+class _LegacyRecord:
+    ''' Stand-in for the Purchase, PurchaseLog and UserAccount objects in a
+        pickled user data file; only their attributes are read.
+    '''
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    ''' Unpickler for the user data file of the pickle-based version, which
+        refuses anything but the objects that file contains.
+    '''
+
+    def find_class(self, module, name):
+        if name in ('Purchase', 'PurchaseLog', 'UserAccount'):
+            return _LegacyRecord
+        if (module, name) == ('datetime', 'date'):
+            return datetime.date
+        raise ValueError('Unexpected object {}.{}'.format(module, name))
+
+
+def _legacy_account(u) -> UserAccount:
+    ''' Converts a pickled user account, hashing its plaintext password '''
+    uaccount = UserAccount.from_password(u.name, u.fullname, u.phone_num,
+                                         u.password, u.country, u.address)
+    for p in u.purchase_log.log:
+        uaccount.purchase_log.add_purchase(Purchase.from_dict({
+            'date': p.date.isoformat(), 'card': p.card, 'amount': p.amount,
+            'status': p.status, 'transaction_fee': p._transaction_fee,
+            'convenience_fee': p._convenience_fee}))
+    return uaccount
+
+
+def _find_legacy_userdata(userdatafile: str) -> Optional[str]:
+    ''' Returns the pickled user data file to import into a new database at
+        userdatafile, if any: either the file at userdatafile itself, or a
+        users.pkl next to a users.db that does not exist yet.
+    '''
+    kind = dbm.whichdb(userdatafile)
+    if kind == '':
+        return userdatafile
+    if kind is None:
+        legacyfile = os.path.splitext(userdatafile)[0] + '.pkl'
+        if legacyfile != userdatafile and dbm.whichdb(legacyfile) == '':
+            return legacyfile
+    return None
+
+
+def _load_legacy_userdata(filename: str) -> Dict[str, UserAccount]:
+    ''' Reads a pickled user data file of the pickle-based version '''
+    with open(filename, 'rb') as f:
+        records = _LegacyUnpickler(f).load()
+    return {uname: _legacy_account(u) for uname, u in records.items()}
 
 
 class Platform:
     ''' Class for the payment platform '''
 
-    def __init__(self, userdatafile='users.pkl'):
+    def __init__(self, userdatafile='users.db'):
         ''' Initializer '''
         self.current_user = None
         self.userdatafile = userdatafile
-        # Load or create user accounts database
-        if os.path.exists(userdatafile) and os.path.isfile(userdatafile):
-            with open(userdatafile, 'rb') as f:
-                userdata = pickle.load(f)
-        else:
-            with open(userdatafile, 'wb') as f:
-                userdata = {}
-                pickle.dump(userdata, f)
-        self.userdata = userdata
-
-    def create_account(self):
-        ''' Create new user account '''
+        self.journalfile = '{}.journal'.format(userdatafile)
+        # Whether the current user has changes not yet saved to the database
+        self._dirty = False
+        # Open or create user accounts database, importing the data file
+        # of an earlier version when the database is first created
+        legacyfile = _find_legacy_userdata(userdatafile)
+        if legacyfile is not None:
+            try:
+                legacy = _load_legacy_userdata(legacyfile)
+            except Exception as e:
+                raise ValueError('Could not import user data from {}: {}'.format(
+                    legacyfile, e)) from e
+            if legacyfile == userdatafile:
+                ## The database takes over the file's name; move it aside
+                legacyfile = '{}.legacy'.format(userdatafile)
+                os.replace(userdatafile, legacyfile)
+        self.userdata = UserDatabase(userdatafile)
+        if legacyfile is not None:
+            for uname, uaccount in legacy.items():
+                self.userdata[uname] = uaccount
+            print('Imported {} user accounts from {}.'.format(len(legacy), legacyfile))
+        # Replay transactions logged since the accounts were last saved
+        replayed = set()
+        if os.path.isfile(self.journalfile):
+            with open(self.journalfile, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    uaccount = self.userdata[record['user']]
+                    # Skip transactions already saved with the account
+                    if record['seq'] <= uaccount.journal_seq:
+                        continue
+                    p = Purchase.from_dict(record['purchase'])
+                    uaccount.purchase_log.add_purchase(p)
+                    uaccount.journal_seq = record['seq']
+                    replayed.add(record['user'])
+        self._journal = open(self.journalfile, 'a')
+        self._save_users(replayed)
+        # Logged in screen options
+        self._logged_in_actions = {
+            1: self.display_info,
+            2: self.upload_purchase,
+            3: self.query_minmax,
+            4: self.print_totals,
+            5: self.print_payment_history,
+            6: self.print_purchase_history,
+            7: self.logout
+        }
+
+    def _save_users(self, unames):
+        ''' Writes the given user accounts back to the database and empties
+            the journal. Each saved account records the sequence number of
+            its last journaled transaction, so a crash before the journal is
+            emptied cannot replay those transactions twice.
+        '''
+        for uname in unames:
+            self.userdata[uname] = self.userdata[uname]
+        self._journal.truncate(0)
+        self._dirty = False
+
+    def close(self):
+        ''' Closes the journal and the user accounts database '''
+        self._journal.close()
+        self.userdata.close()
+
+    def _collect_account_fields(self) -> Dict[str, Any]:
+        ''' Prompts for the details of a new user account '''
         # Username
         while True:
             uname = input('Please enter your desired username: ')
@@ -167,26 +530,26 @@ class Platform:
                 break
         # Password
         while True:
-            passwd = input('Please enter your password: ')
-            passwd2 = input('Please confirm your password: ')
+            passwd = getpass.getpass('Please enter your password: ')
+            passwd2 = getpass.getpass('Please confirm your password: ')
             if passwd == passwd2:
                 print('Passwords match. Your new password has been accepted.')
                 break
             else:
                 print('Passwords do not match. Please try again.')
         # More info
-        fullname = input('Please enter your full name: ')
-        phone_num = input('Please enter your phone number: ')
-        country = input('Please enter your country of residence: ')
-        address = input('Please provide your full address: ')
+        return {'name': uname, 'password': passwd,
+                'fullname': input('Please enter your full name: '),
+                'phone_num': input('Please enter your phone number: '),
+                'country': input('Please enter your country of residence: '),
+                'address': input('Please provide your full address: ')}
+
+    def create_account(self):
+        ''' Create new user account '''
         # Create user account
-        uaccount = UserAccount(name=uname, fullname=fullname, \
-                               phone_num=phone_num, password=passwd, country=country, \
-                               address=address)
+        uaccount = UserAccount.from_password(**self._collect_account_fields())
         # Add to database
-        self.userdata[uname] = uaccount
-        with open(self.userdatafile, 'wb') as f:
-            pickle.dump(self.userdata, f)
+        self.userdata[uaccount.name] = uaccount
         print('New user account successfully created')
 
     def login(self):
@@ -197,8 +560,8 @@ class Platform:
             print('Unknown username: {}'.format(uname))
             return
         # Password
-        passwd = input('Please enter your password: ')
-        if passwd == self.userdata[uname].password:
+        passwd = getpass.getpass('Please enter your password: ')
+        if self.userdata[uname].check_password(passwd):
             self.current_user = uname
             print('Login Successful.')
         else:
@@ -206,9 +569,9 @@ class Platform:
 
     def logout(self):
         ''' Function to log a user out '''
-        # Dump the current logs back to file
-        with open(self.userdatafile, 'wb') as f:
-            pickle.dump(self.userdata, f)
+        # Save the current user's logs back to the database, if changed
+        if self._dirty:
+            self._save_users([self.current_user])
         # Log user out
         self.current_user = None
         print('Successfully logged out.')
@@ -217,32 +580,101 @@ class Platform:
         ''' Function to query your information '''
         if self.current_user is not None:
             print('Username: {}'.format(self.userdata[self.current_user].name))
-            print('Password: {}'.format(self.userdata[self.current_user].password))
             print('Full name: {}'.format(self.userdata[self.current_user].fullname))
             print('Phone number: {}'.format(self.userdata[self.current_user].phone_num))
             print('Country: {}'.format(self.userdata[self.current_user].country))
             print('Address: {}'.format(self.userdata[self.current_user].address))
 
+    def _collect_purchase_fields(self) -> Optional[Dict[str, Any]]:
+        ''' Prompts for the details of a transaction, in the format read by
+            Purchase.from_dict. Returns None if the card type is not
+            supported.
+        '''
+        datestring = input('Enter date in format YYYY-MM-DD: ')
+        card = input('Enter card type: ').lower()
+        if card not in _VALID_CARDS:
+            print('Acceptable card types are: {}'.format(list(card_rate.keys())))
+            return None
+        amount = float(input('Enter amount: '))
+        statusstr = input('Enter 1 for payment or defaults to purchase: ')
+        return {'date': datestring, 'card': card, 'amount': amount,
+                'status': statusstr.strip() == '1'}
+
     def upload_purchase(self):
         ''' Upload a purchase '''
         if self.current_user is not None:
             # Get transaction info
-            datestring = input('Enter date in format YYYY-MM-DD: ')
-            date = datetime.date.fromisoformat(datestring)
-            card = input('Enter card type: ').lower()
-            assert card in card_rate, 'Acceptable card types are: {}'.format(list(card_rate.keys()))
-            amount = float(input('Enter amount: '))
-            statusstr = input('Enter 1 for payment or defaults to purchase: ')
-            status = True if int(statusstr) == 1 else False
+            fields = self._collect_purchase_fields()
+            if fields is None:
+                return
             # Generate transaction
-            p = Purchase(date, card, amount, status)
-            self.userdata[self.current_user].purchase_log.add_purchase(p)
-
-            # Dump the current logs back to file
-            with open(self.userdatafile, 'wb') as f:
-                pickle.dump(self.userdata, f)
+            p = Purchase.from_dict(fields)
+            uaccount = self.userdata[self.current_user]
+            uaccount.purchase_log.add_purchase(p)
+            uaccount.journal_seq += 1
+            self._dirty = True
+
+            # Append the transaction to the journal
+            self._journal.write(json.dumps({'user': self.current_user,
+                                            'seq': uaccount.journal_seq,
+                                            'purchase': p.to_dict()}) + '\n')
+            self._journal.flush()
             print('Transaction logged: {}'.format(p))
 
+    def import_purchases(self, batchfile):
+        ''' Imports transactions from a JSON lines file, one record per line
+            with a 'user' key and the fields read by Purchase.from_dict.
+            Every record is validated before any is added, so nothing is
+            imported if one line is invalid; each affected user account is
+            then saved once.
+        '''
+        # Parse and validate all records first
+        purchases = []
+        try:
+            with open(batchfile, 'r') as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError) as e:
+            print('Could not read batch file {}: {}'.format(batchfile, e))
+            return
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                uname = record['user']
+                ## Amounts must be finite numbers, or strings of them
+                amount = record['amount']
+                if isinstance(amount, bool) or not math.isfinite(float(amount)):
+                    raise ValueError('Invalid amount: {!r}'.format(amount))
+                ## Status must be a boolean, or 0/1 as at the prompt
+                status = record.get('status', False)
+                if not isinstance(status, int) or status not in (0, 1):
+                    raise ValueError('Invalid status: {!r}'.format(status))
+                p = Purchase.from_dict({'date': str(record['date']),
+                                        'card': str(record['card']).lower(),
+                                        'amount': float(amount),
+                                        'status': bool(status)})
+            except KeyError as e:
+                print('Missing field {} on line {}. No transactions were '
+                      'imported.'.format(e, lineno))
+                return
+            except (TypeError, ValueError) as e:
+                print('Invalid transaction on line {}: {}. No transactions '
+                      'were imported.'.format(lineno, str(e).rstrip('.')))
+                return
+            if uname not in self.userdata:
+                print('Unknown username: {} on line {}. No transactions were '
+                      'imported.'.format(uname, lineno))
+                return
+            purchases.append((uname, p))
+        # Add them to the purchase logs
+        for uname, p in purchases:
+            self.userdata[uname].purchase_log.add_purchase(p)
+        imported = {uname for uname, p in purchases}
+        self._save_users(imported)
+        print('Imported {} transactions for {} users.'.format(len(purchases),
+                                                               len(imported)))
+
     def query_minmax(self):
         ''' Returns the minimum and maximum transactions '''
         if self.current_user is not None:
@@ -265,8 +697,8 @@ class Platform:
             # Generate table
             table = PrettyTable(['Date (YYYY-MM-DD)', 'Card', 'Amount paid', 'Billing Cycle'])
             payments = self.userdata[self.current_user].purchase_log.query_purchases(True)
-            for p in payments:
-                table.add_row([p.date, p.card, p.final_amount, p.billing_cycle])
+            table.add_rows([(p.date, p.card, p.final_amount, p.billing_cycle)
+                            for p in payments])
             print(table)
 
     def print_purchase_history(self):
@@ -279,11 +711,12 @@ class Platform:
             d2 = datetime.date.fromisoformat(d2)
             # Generate table
             table = PrettyTable(['Date (YYYY-MM-DD)', 'Card', 'Amount paid', 'Billing Cycle'])
-            purchases = self.userdata[self.current_user].purchase_log.query_purchases(False)
-            for p in purchases:
-                if d1 <= p.date <= d2:
-                    table.add_row([p.date, p.card, p.final_amount, p.billing_cycle])
+            purchases = self.userdata[self.current_user].purchase_log.query_range(d1, d2)
+            table.add_rows([(p.date, p.card, p.final_amount, p.billing_cycle)
+                            for p in purchases])
             print(table)
+            print('Total due in date range: {}'.format(
+                self.userdata[self.current_user].purchase_log.range_due(d1, d2)))
 
     def launch(self):
         ''' Launches the UI loop for platform '''
@@ -293,11 +726,11 @@ class Platform:
             print('1. Create a new account')
             print('2. Login to an existing account')
             print('3. Exit')
-            O1 = input('Please select an option to proceed: ')
-            try:
-                O1 = int(O1)
-            except Exception:
+            m = _LOGIN_MENU_RE.match(input('Please select an option to proceed: ').strip())
+            if m is None:
                 print('Incorrect option. Please enter 1, 2 or 3 to proceed.')
+                continue
+            O1 = int(m.group())
             if O1 == 1:
                 # Create new account
                 self.create_account()
@@ -315,38 +748,13 @@ class Platform:
                     print('5. Retrieve payment history')
                     print('6. Display purchase history')
                     print('7. Log out')
-                    O2 = input('Please select an option to proceed: ')
-                    try:
-                        O2 = int(O2)
-                    except Exception:
-                        print('Incorrect option. Please enter a number in 1-7 to proceed.')
-                    if O2 == 1:
-                        # Display user info
-                        self.display_info()
-                    elif O2 == 2:
-                        # Upload a purchase
-                        self.upload_purchase()
-                    elif O2 == 3:
-                        # Show minimum and maximum transaction
-                        self.query_minmax()
-                    elif O2 == 4:
-                        # Show amount due and total paid
-                        self.print_totals()
-                    elif O2 == 5:
-                        # Retrieve payment history
-                        self.print_payment_history()
-                    elif O2 == 6:
-                        # Display purchase history
-                        self.print_purchase_history()
-                    elif O2 == 7:
-                        # Log out
-                        self.logout()
+                    m = _MENU_RE.match(input('Please select an option to proceed: ').strip())
+                    if m is not None:
+                        self._logged_in_actions[int(m.group())]()
                     else:
                         print('Incorrect option. Please enter a number in 1-7 to proceed.')
             elif O1 == 3:
                 break
-            else:
-                print('Incorrect option. Please enter 1, 2 or 3 to proceed.')
 
 
 ############### Main ###############
@@ -356,9 +764,24 @@ if __name__ == '__main__':
     # Parse arguments
     parser = argparse.ArgumentParser(description='Payment System Launcher.')
     parser.add_argument('-udf', '--userdatafile',
-                        type=str, default='users.pkl',
+                        type=str, default='users.db',
                         help='User data file.')
+    parser.add_argument('-bf', '--batch-file',
+                        type=str, default=None,
+                        help='JSON lines file of transactions to import '
+                             'instead of launching the platform.')
     args = parser.parse_args()
 
-    # Launch platform
-    Platform(args.userdatafile).launch()
\ No newline at end of file
+    try:
+        platform = Platform(args.userdatafile)
+    except ValueError as e:
+        parser.exit(1, '{}\n'.format(e))
+    try:
+        if args.batch_file is not None:
+            # Import transactions
+            platform.import_purchases(args.batch_file)
+        else:
+            # Launch platform
+            platform.launch()
+    finally:
+        platform.close()
\ No newline at end of file